@@ -48,10 +48,19 @@ def get_args(monitor_path='tmp.monitor', max_iter=234300, model_save_path='tmp.m
                         help="Neural network architecture type (used only in classification.py).\n"
                         "'cifar10_resnet23'\n"
                         "'cifar100_resnet23'")
-    parser.add_argument("--with-all-reduce-callback", action='store_true',
-                        help="Use all_reduce_callback API instead of all_reduce")
+    parser.add_argument("--with-all-reduce-callback", dest='with_all_reduce_callback',
+                        action='store_true', default=True,
+                        help="Use all_reduce_callback API instead of all_reduce (default).")
+    parser.add_argument("--without-all-reduce-callback", dest='with_all_reduce_callback',
+                        action='store_false',
+                        help="All-reduce gradients after the whole backward computation.")
+    parser.add_argument("--all-reduce-bucket-mb", type=float, default=None,
+                        help="Size in MiB of the gradient buckets all-reduced by all_reduce_callback, assuming 4-byte elements (with `-t half` a bucket holds twice as many values). "
+                        "By default, a quarter of all gradients, up to 8 MiB, so that all-reduce overlaps with backward.")
     parser.add_argument('--sync-bn', action='store_true',
-                        help="Use Synchronized batch normalization.")
+                        help="Use Synchronized batch normalization. It adds communication in every BN layer, so use it only for small local batch sizes.")
+    parser.add_argument("--valid-on-single-process", action='store_true',
+                        help="Validate on the whole data only in the process of rank 0 instead of sharding it over all processes. Useful for small validation data.")
     parser.add_argument("--use-latest-checkpoint", action='store_true',
                         help='load latest checkpoint file in model_save_path if exist')
     return parser.parse_args()
@@ -30,6 +30,9 @@ from nnabla.utils.data_source import DataSource
 from nnabla.utils.data_source_loader import download, get_data_home
 
 
+DATA_URI = "https://www.cs.toronto.edu/~kriz/cifar-100-python.tar.gz"
+
+
 class Cifar100DataSource(DataSource):
     '''
     Get data directly from cifar100 dataset from Internet(yann.lecun.com).
@@ -44,7 +47,7 @@ class Cifar100DataSource(DataSource):
         super(Cifar100DataSource, self).__init__(shuffle=shuffle, rng=rng)
 
         self._train = train
-        data_uri = "https://www.cs.toronto.edu/~kriz/cifar-100-python.tar.gz"
+        data_uri = DATA_URI
         logger.info('Getting labeled data from {}.'.format(data_uri))
         r = download(data_uri)  # file object returned
         with tarfile.open(fileobj=r, mode="r:gz") as fpin:
@@ -119,3 +122,12 @@ def data_iterator_cifar100(batch_size,
                                       rng,
                                       with_memory_cache,
                                       with_file_cache)
+
+
+def ensure_cifar100_downloaded():
+    '''
+    Download the cifar100 dataset into the data home unless it is cached already,
+    so that the data sources created afterwards only read the cached file.
+    '''
+    r = download(DATA_URI)  # file object returned
+    r.close()
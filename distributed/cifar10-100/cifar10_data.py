@@ -30,6 +30,9 @@ from nnabla.utils.data_source import DataSource
 from nnabla.utils.data_source_loader import download, get_data_home
 
 
+DATA_URI = "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
+
+
 class Cifar10DataSource(DataSource):
     '''
     Get data directly from cifar10 dataset from Internet(yann.lecun.com).
@@ -44,7 +47,7 @@ class Cifar10DataSource(DataSource):
         super(Cifar10DataSource, self).__init__(shuffle=shuffle, rng=rng)
 
         self._train = train
-        data_uri = "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
+        data_uri = DATA_URI
         logger.info('Getting labeled data from {}.'.format(data_uri))
         r = download(data_uri)  # file object returned
         with tarfile.open(fileobj=r, mode="r:gz") as fpin:
@@ -121,3 +124,12 @@ def data_iterator_cifar10(batch_size,
                                       rng,
                                       with_memory_cache,
                                       with_file_cache)
+
+
+def ensure_cifar10_downloaded():
+    '''
+    Download the cifar10 dataset into the data home unless it is cached already,
+    so that the data sources created afterwards only read the cached file.
+    '''
+    r = download(DATA_URI)  # file object returned
+    r.close()
@@ -46,6 +46,19 @@ def batch_normalization(h, test=False, comm=None, group="world"):
     return h
 
 
+def batch_normalization_act(h, act, z=None, test=False, comm=None, group="world"):
+    """
+    BN -> (Residual) -> Nonlinear. The three are fused into a single function
+    when the local batch normalization is followed by ReLU.
+    """
+    if comm is None and act is F.relu:
+        return PF.fused_batch_normalization(h, z, batch_stat=not test)
+    h = batch_normalization(h, test=test, comm=comm, group=group)
+    if z is not None:
+        h = F.add2(h, z, inplace=False)
+    return act(h)
+
+
 def resnet23_prediction(image, test=False, rng=None, ncls=10, nmaps=64, act=F.relu, comm=None, group="world"):
     """
     Construct ResNet 23
@@ -58,21 +71,20 @@ def resnet23_prediction(image, test=False, rng=None, ncls=10, nmaps=64, act=F.re
             with nn.parameter_scope("conv1"):
                 h = PF.convolution(x, C // 2, kernel=(1, 1), pad=(0, 0),
                                    with_bias=False)
-                h = batch_normalization(h, test=test, comm=comm, group=group)
-                h = act(h)
+                h = batch_normalization_act(
+                    h, act, test=test, comm=comm, group=group)
             # Conv -> BN -> Nonlinear
             with nn.parameter_scope("conv2"):
                 h = PF.convolution(h, C // 2, kernel=(3, 3), pad=(1, 1),
                                    with_bias=False)
-                h = batch_normalization(h, test=test, comm=comm, group=group)
-                h = act(h)
-            # Conv -> BN
+                h = batch_normalization_act(
+                    h, act, test=test, comm=comm, group=group)
+            # Conv -> BN -> Residual -> Nonlinear
             with nn.parameter_scope("conv3"):
                 h = PF.convolution(h, C, kernel=(1, 1), pad=(0, 0),
                                    with_bias=False)
-                h = batch_normalization(h, test=test, comm=comm, group=group)
-            # Residual -> Nonlinear
-            h = act(F.add2(h, x, inplace=False))
+                h = batch_normalization_act(
+                    h, act, z=x, test=test, comm=comm, group=group)
             # Maxpooling
             if dn:
                 h = F.max_pooling(h, kernel=(2, 2), stride=(2, 2))
@@ -87,8 +99,7 @@ def resnet23_prediction(image, test=False, rng=None, ncls=10, nmaps=64, act=F.re
             image.need_grad = False
         h = PF.convolution(image, nmaps, kernel=(3, 3),
                            pad=(1, 1), with_bias=False)
-        h = batch_normalization(h, test=test, comm=comm, group=group)
-        h = act(h)
+        h = batch_normalization_act(h, act, test=test, comm=comm, group=group)
 
     h = res_unit(h, "conv2", rng, False)    # -> 32x32
     h = res_unit(h, "conv3", rng, True)     # -> 16x16
@@ -19,11 +19,14 @@ import re
 import time
 from args import get_args
 
-from cifar10_data import data_iterator_cifar10
-from cifar100_data import data_iterator_cifar100
+from cifar10_data import (
+    Cifar10DataSource, data_iterator_cifar10, ensure_cifar10_downloaded)
+from cifar100_data import (
+    Cifar100DataSource, data_iterator_cifar100, ensure_cifar100_downloaded)
 from nnabla.utils.data_iterator import data_iterator
 import nnabla as nn
 import nnabla.communicators as C
+from nnabla.logger import logger
 from nnabla.ext_utils import get_extension_context
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
@@ -32,17 +35,30 @@ import numpy as np
 import functools
 from models import (resnet23_prediction, categorical_error, loss_function)
 from checkpoint import save_checkpoint, load_checkpoint
+from data_prefetcher import DataPrefetcher
 
 
-def backward_and_all_reduce(loss, comm, with_all_reduce_callback=False):
-    params = [x.grad for x in nn.get_parameters().values()]
+def set_input(x, value):
+    """
+    Write a host array into an input variable in-place. The write-only access
+    skips transferring the previous contents of `x` back from the device, and
+    the data keeps its own dtype so that any cast happens on the device.
+    """
+    value = np.asarray(value)
+    x.data.get_data('w', dtype=value.dtype)[...] = value
+
+
+def backward_and_all_reduce(loss, comm, grads, with_all_reduce_callback=True, pack_size=1024 * 1024 * 2):
     if with_all_reduce_callback:
-        # All-reduce gradients every 2MiB parameters during backward computation
+        # All-reduce gradients every `pack_size` parameters during backward computation
         loss.backward(clear_buffer=True,
-                      communicator_callbacks=comm.all_reduce_callback(params, 1024 * 1024 * 2))
+                      communicator_callbacks=comm.all_reduce_callback(grads, pack_size))
     else:
         loss.backward(clear_buffer=True)
-        comm.all_reduce(params, division=False, inplace=False)
+        # With inplace=False, all gradients are packed into one contiguous
+        # buffer which is all-reduced by a single call, then unpacked.
+        # Gradient arrays cannot alias slices of such a buffer from Python.
+        comm.all_reduce(grads, division=False, inplace=False)
 
 
 def train():
@@ -85,18 +101,32 @@ def train():
     device_id = mpi_local_rank
     ctx.device_id = str(device_id)
     nn.set_default_context(ctx)
+    # Context to sum up monitored values in float even with half computation
+    ctx_float = get_extension_context(extension_module, type_config='float')
+    ctx_float.device_id = str(device_id)
 
     # Model
     rng = np.random.RandomState(313)
     comm_syncbn = comm if args.sync_bn else None
+    if args.sync_bn and mpi_rank == 0:
+        # Each synchronized BN layer all-reduces its batch statistics in both
+        # forward and backward, which adds many small all-reduces per iteration.
+        logger.warning(
+            "Synchronized batch normalization adds 2 all-reduces per BN layer "
+            "per iteration. It is only recommended when the local batch size "
+            "is smaller than 16 (current: {}).".format(args.batch_size))
     if args.net == "cifar10_resnet23":
         prediction = functools.partial(
             resnet23_prediction, rng=rng, ncls=10, nmaps=32, act=F.relu, comm=comm_syncbn)
         data_iterator = data_iterator_cifar10
+        data_source = Cifar10DataSource
+        ensure_dataset_downloaded = ensure_cifar10_downloaded
     if args.net == "cifar100_resnet23":
         prediction = functools.partial(
             resnet23_prediction, rng=rng, ncls=100, nmaps=384, act=F.elu, comm=comm_syncbn)
         data_iterator = data_iterator_cifar100
+        data_source = Cifar100DataSource
+        ensure_dataset_downloaded = ensure_cifar100_downloaded
 
     # Create training graphs
     image_train = nn.Variable((args.batch_size, 3, 32, 32))
@@ -114,16 +144,37 @@ def train():
     image_valid = nn.Variable((bs_valid, 3, 32, 32))
     label_valid = nn.Variable((args.batch_size, 1))
     pred_valid = prediction(image_valid, test=True)
-    error_valid = F.mean(F.top_n_error(pred_valid, label_valid, axis=1))
+    loss_valid = loss_function(pred_valid, label_valid).apply(persistent=True)
+    error_valid = F.mean(F.top_n_error(
+        pred_valid, label_valid, axis=1)).apply(persistent=True)
+    loss_error_valid = F.sink(loss_valid, error_valid)
     input_image_valid = {"image": image_valid, "label": label_valid}
 
     # Solvers
     solver = S.Adam()
     solver.set_parameters(nn.get_parameters())
+    # Gradients to be all-reduced. `grad` of each parameter is the same array
+    # across iterations, so the list is built only once here. Small gradients
+    # are packed together into buckets of `pack_size` values by the
+    # all_reduce_callback. They are listed in reverse declaration order, which
+    # is the order backward computes them, so that the first bucket gets ready
+    # as early as possible.
+    grads = [x.grad for x in list(nn.get_parameters().values())[::-1]]
+    # The bucket size is given in MiB of 4-byte elements. By default, it is
+    # set well below the total size of gradients so that there are at least a
+    # few buckets; otherwise the single bucket is all-reduced only after the
+    # whole backward computation.
+    if args.all_reduce_bucket_mb is None:
+        pack_size = min(1024 * 1024 * 2,
+                        max(1, sum(g.size for g in grads) // 4))
+    else:
+        pack_size = int(args.all_reduce_bucket_mb * 1024 * 1024 / 4)
     base_lr = args.learning_rate
     warmup_iter = int(1. * n_train_samples /
                       args.batch_size / n_devices) * args.warmup_epoch
     warmup_slope = base_lr * (n_devices - 1) / warmup_iter
+    # Learning rates of the linear warmup, indexed by iteration
+    warmup_lrs = base_lr + warmup_slope * np.arange(warmup_iter + 1)
     solver.set_learning_rate(base_lr)
 
     # load checkpoint if file exist.
@@ -140,11 +191,18 @@ def train():
     # Create monitor
     from nnabla.monitor import Monitor, MonitorSeries, MonitorTimeElapsed
     monitor = Monitor(args.monitor_path)
-    monitor_loss = MonitorSeries("Training loss", monitor, interval=10)
-    monitor_err = MonitorSeries("Training error", monitor, interval=10)
-    monitor_time = MonitorTimeElapsed("Training time", monitor, interval=10)
+    # Training loss and error are summed up on device, and their means are
+    # fetched and output only every `log_interval` iterations.
+    log_interval = 10
+    tl_acc = nn.NdArray()
+    te_acc = nn.NdArray()
+    tl_acc.zero()
+    te_acc.zero()
+    n_acc = 0
+    monitor_loss = MonitorSeries("Training loss", monitor, interval=1)
+    monitor_err = MonitorSeries("Training error", monitor, interval=1)
+    monitor_vloss = MonitorSeries("Validation loss", monitor, interval=1)
     monitor_verr = MonitorSeries("Validation error", monitor, interval=1)
-    monitor_vtime = MonitorTimeElapsed("Validation time", monitor, interval=1)
 
     # Data Iterator
 
@@ -153,53 +211,95 @@ def train():
     # necessary to execute initial data preparation by the representative
     # process (local_rank is 0) on the host.
 
-    # Prepare data only when local_rank is 0
-    if mpi_rank == 0:
-        rng = np.random.RandomState(device_id)
-        _, tdata = data_iterator(args.batch_size, True, rng)
-        vsource, vdata = data_iterator(args.batch_size, False)
+    # Download data only when local_rank is 0
+    if mpi_local_rank == 0:
+        ensure_dataset_downloaded()
 
-    # Wait for data to be prepared without watchdog
+    # Wait for data to be downloaded without watchdog
     comm.barrier()
 
-    # Prepare data when local_rank is not 0
-    if mpi_rank != 0:
-        rng = np.random.RandomState(device_id)
-        _, tdata = data_iterator(args.batch_size, True, rng)
-        vsource, vdata = data_iterator(args.batch_size, False)
-
-    # loss_error_train.forward()
+    # All processes read the downloaded data
+    # The training data source is shuffled once per epoch with the same seed
+    # in all processes, and each process takes its own contiguous slice of it,
+    # so that the processes iterate over disjoint shards.
+    _, tdata = data_iterator(args.batch_size, True, np.random.RandomState(313))
+    tdata = tdata.slice(rng=None, num_of_slices=n_devices, slice_pos=mpi_rank)
+    # Validation reads the data source directly in order, so neither an
+    # iterator nor a shuffled index is needed.
+    vsource = data_source(train=False, shuffle=False)
+
+    # Load next mini-batches in background during the training step
+    tdata = DataPrefetcher(tdata)
+
+    # Validation data of this process. The mean error does not depend on the
+    # order of samples, so each process walks its own contiguous shard split
+    # into mini-batches once here (note that smaller batch is ignored). Images
+    # are cast to float32 once so that no cast is needed per mini-batch.
+    # With --valid-on-single-process, the process of rank 0 validates on the
+    # whole data alone, which needs no all-reduce.
+    if args.valid_on_single_process:
+        # Other processes get an empty shard on purpose; they run no
+        # validation and wait for rank 0 at the next gradient all-reduce.
+        n_valid_local = n_valid_samples // bs_valid * bs_valid if mpi_rank == 0 else 0
+        valid_start = 0
+    else:
+        n_valid_local = n_valid_samples // n_devices // bs_valid * bs_valid
+        valid_start = n_valid_samples // n_devices * mpi_rank
+    valid_end = valid_start + n_valid_local
+    val_images = vsource.images[valid_start:valid_end].astype(np.float32).reshape(
+        (-1, bs_valid) + vsource.images.shape[1:])
+    val_labels = vsource.labels[valid_start:valid_end].reshape(
+        (-1, bs_valid) + vsource.labels.shape[1:])
+
+    # Warm up with a dummy mini-batch right before the training loop, so that
+    # algorithm selection and buffer allocation do not slow the first
+    # iteration. BN running statistics are restored after the warmup.
+    params = nn.get_parameters(grad_only=False)
+    bn_stats = {k: v.d.copy() for k, v in params.items() if not v.need_grad}
+    set_input(image_train, np.zeros(image_train.shape, dtype=np.float32))
+    set_input(label_train, np.zeros(label_train.shape, dtype=np.int32))
+    loss_error_train.forward(clear_no_need_grad=True)
+    loss_error_train.backward(clear_buffer=True)
+    solver.zero_grad()
+    for k, d in bn_stats.items():
+        params[k].d = d
+
+    # Timers start after all the setup and the warmup
+    monitor_time = MonitorTimeElapsed("Training time", monitor, interval=10)
+    monitor_vtime = MonitorTimeElapsed("Validation time", monitor, interval=1)
 
     # Training-loop
-    ve = nn.Variable()
+    # Sums of validation error and loss, and the number of mini-batches, which
+    # are all-reduced at once.
+    ve = nn.Variable((3,))
+    # Validation error and loss are summed up on device during validation
+    ve_acc = nn.NdArray()
+    vl_acc = nn.NdArray()
     model_save_interval = 0
     for i in range(start_point, int(args.max_iter / n_devices)):
         # Validation
         if i % int(n_train_samples / args.batch_size / n_devices) == 0:
-            ve_local = 0.
+            ve_acc.zero()
+            vl_acc.zero()
             k = 0
-            idx = np.random.permutation(n_valid_samples)
-            val_images = vsource.images[idx]
-            val_labels = vsource.labels[idx]
-            for j in range(int(n_valid_samples / n_devices * mpi_rank),
-                           int(n_valid_samples / n_devices * (mpi_rank + 1)),
-                           bs_valid):
-                image = val_images[j:j + bs_valid]
-                label = val_labels[j:j + bs_valid]
-                if len(image) != bs_valid:  # note that smaller batch is ignored
-                    continue
-                input_image_valid["image"].d = image
-                input_image_valid["label"].d = label
-                error_valid.forward(clear_buffer=True)
-                ve_local += error_valid.d.copy()
+            for image, label in zip(val_images, val_labels):
+                set_input(input_image_valid["image"], image)
+                set_input(input_image_valid["label"], label)
+                loss_error_valid.forward(clear_buffer=True)
+                with nn.context_scope(ctx_float):
+                    ve_acc += error_valid.data
+                    vl_acc += loss_valid.data
                 k += 1
-            ve_local /= k
-            ve.d = ve_local
-            comm.all_reduce(ve.data, division=True, inplace=True)
+            ve.d = [float(ve_acc.get_data('r')),
+                    float(vl_acc.get_data('r')), k]
+            if not args.valid_on_single_process:
+                comm.all_reduce(ve.data, division=False, inplace=True)
 
             # Save model
             if mpi_rank == 0:
-                monitor_verr.add(i * n_devices, ve.d.copy())
+                ve_sum, vl_sum, n_batch = ve.d
+                monitor_verr.add(i * n_devices, ve_sum / n_batch)
+                monitor_vloss.add(i * n_devices, vl_sum / n_batch)
                 monitor_vtime.add(i * n_devices)
                 if model_save_interval <= 0:
                     nn.save_parameters(os.path.join(
@@ -211,30 +311,42 @@ def train():
 
         # Forward/Zerograd
         image, label = tdata.next()
-        input_image_train["image"].d = image
-        input_image_train["label"].d = label
+        set_input(input_image_train["image"], image)
+        set_input(input_image_train["label"], label)
         loss_error_train.forward(clear_no_need_grad=True)
         solver.zero_grad()
 
         # Backward/AllReduce
         backward_and_all_reduce(
-            loss_error_train, comm, with_all_reduce_callback=args.with_all_reduce_callback)
+            loss_error_train, comm, grads,
+            with_all_reduce_callback=args.with_all_reduce_callback,
+            pack_size=pack_size)
 
         # Solvers update
         solver.update()
 
         # Linear Warmup
-        if i <= warmup_iter:
-            lr = base_lr + warmup_slope * i
-            solver.set_learning_rate(lr)
+        if i < len(warmup_lrs):
+            solver.set_learning_rate(float(warmup_lrs[i]))
 
         if mpi_rank == 0:  # loss and error locally, and elapsed time
-            monitor_loss.add(i * n_devices, loss_train.d.copy())
-            monitor_err.add(i * n_devices, error_train.d.copy())
+            with nn.context_scope(ctx_float):
+                tl_acc += loss_train.data
+                te_acc += error_train.data
+            n_acc += 1
+            if i % log_interval == 0:
+                monitor_loss.add(i * n_devices,
+                                 float(tl_acc.get_data('r')) / n_acc)
+                monitor_err.add(i * n_devices,
+                                float(te_acc.get_data('r')) / n_acc)
+                tl_acc.zero()
+                te_acc.zero()
+                n_acc = 0
             monitor_time.add(i * n_devices)
 
         # exit(0)
 
+    tdata.close()
     if mpi_rank == 0:
         nn.save_parameters(os.path.join(
             args.model_save_path,
@@ -61,6 +61,8 @@ def get_args(monitor_path='tmp.monitor', max_iter=234375, model_save_path=None,
                         default=0.25, help="Reduction rate, should be less than 1.")
     parser.add_argument('--use-batch', type=int,
                         default=1, help="Use batch stats in teacher net when distilling, default is true.")
+    parser.add_argument('--teacher-type-config', type=str,
+                        default='half', help='Type of computation of teacher net when distilling. e.g. "float", "half".')
     parser.add_argument('--weight-ce', type=float,
                         default=0.5, help="Weight for cross entropy.")
     parser.add_argument('--weight-ce-soft', type=float,
@@ -0,0 +1,46 @@
+# Copyright (c) 2017 Sony Corporation. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Provide a prefetcher which loads next mini-batches in background.
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DataPrefetcher(object):
+    '''
+    Wrap a DataIterator to load next mini-batches in a background thread
+    while the current one is being computed.
+
+    Args:
+        data: DataIterator (or any object having `next()`).
+        depth (int): The number of mini-batches loaded in advance.
+
+    '''
+
+    def __init__(self, data, depth=2):
+        self._data = data
+        # Single worker because DataIterator.next() is not thread-safe.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = deque(self._executor.submit(self._data.next)
+                            for _ in range(depth))
+
+    def next(self):
+        batch = self._queue.popleft().result()
+        self._queue.append(self._executor.submit(self._data.next))
+        return batch
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -18,6 +18,7 @@ from six.moves import range
 import os
 import sys
 
+import numpy as np
 import nnabla as nn
 import nnabla.logger as logger
 import nnabla.functions as F
@@ -26,10 +27,21 @@ import nnabla.solvers as S
 import nnabla.utils.save as save
 
 from args import get_args
-from cifar10_data import data_iterator_cifar10
+from cifar10_data import data_iterator_cifar10, Cifar10DataSource
+from data_prefetcher import DataPrefetcher
 from models import cifar10_resnet23_prediction, categorical_error, ce_soft
 
 
+def set_input(x, value):
+    """
+    Write a host array into an input variable in-place. The write-only access
+    skips transferring the previous contents of `x` back from the device, and
+    the data keeps its own dtype so that any cast happens on the device.
+    """
+    value = np.asarray(value)
+    x.data.get_data('w', dtype=value.dtype)[...] = value
+
+
 def distil():
     args = get_args()
 
@@ -44,6 +56,7 @@ def distil():
     if args.net == "cifar10_resnet23_prediction":
         model_prediction = cifar10_resnet23_prediction
         data_iterator = data_iterator_cifar10
+        data_source = Cifar10DataSource
         c = 3
         h = w = 32
         n_train = 50000
@@ -56,21 +69,28 @@ def distil():
     rrate = args.reduction_rate
     # Create input variables.
     image = nn.Variable([args.batch_size, c, h, w])
-    image.persistent = True  # not clear the intermediate buffer re-used
     label = nn.Variable([args.batch_size, 1])
-    label.persistent = True  # not clear the intermediate buffer re-used
     # Create `teacher` and "student" prediction graph.
     model_load_path = args.model_load_path
     nn.load_parameters(model_load_path)
-    pred_label = model_prediction(
-        image, net=teacher, maps=maps, test=not args.use_batch)
+    # The teacher is only used for inference, so it can run in a lower
+    # precision. Its output is cast back when consumed by `ce_soft`.
+    teacher_ctx = get_extension_context(
+        args.context, device_id=args.device_id, type_config=args.teacher_type_config)
+    with nn.context_scope(teacher_ctx):
+        pred_label = model_prediction(
+            image, net=teacher, maps=maps, test=not args.use_batch)
     pred_label.need_grad = False  # no need backward through teacher graph
     pred = model_prediction(image, net=student, maps=int(
         maps * (1. - rrate)), test=False)
-    pred.persistent = True  # not clear the intermediate buffer used
     loss_ce = F.mean(F.softmax_cross_entropy(pred, label))
     loss_ce_soft = ce_soft(pred, pred_label)
     loss = args.weight_ce * loss_ce + args.weight_ce_soft * loss_ce_soft
+    loss.persistent = True  # not clear the buffer read after backward
+    # Training error is computed in the graph, so only this scalar is kept
+    # instead of the whole prediction.
+    error = F.mean(F.top_n_error(pred, label, axis=1)).apply(persistent=True)
+    loss_error = F.sink(loss, error)
 
     # TEST
     # Create input variables.
@@ -88,50 +108,68 @@ def distil():
     # Create monitor.
     from nnabla.monitor import Monitor, MonitorSeries, MonitorTimeElapsed
     monitor = Monitor(args.monitor_path)
-    monitor_loss = MonitorSeries("Training loss", monitor, interval=10)
-    monitor_err = MonitorSeries("Training error", monitor, interval=10)
+    # Training loss and error are fetched from device only every
+    # `log_interval` iterations, and each fetched value is output.
+    log_interval = 10
+    monitor_loss = MonitorSeries("Training loss", monitor, interval=1)
+    monitor_err = MonitorSeries("Training error", monitor, interval=1)
     monitor_time = MonitorTimeElapsed("Training time", monitor, interval=100)
     monitor_verr = MonitorSeries("Test error", monitor, interval=1)
 
     # Initialize DataIterator for MNIST.
-    data = data_iterator(args.batch_size, True)
-    vdata = data_iterator(args.batch_size, False)
+    # Next mini-batches are loaded in background during computation.
+    data = DataPrefetcher(data_iterator(args.batch_size, True))
+    # Validation data split into mini-batches once. The order of samples does
+    # not matter for the mean error, so they are walked in order. Images are
+    # cast to float32 once so that no cast is needed per mini-batch.
+    vsource = data_source(train=False, shuffle=False)
+    n_vbatch = n_valid // args.batch_size
+    vimages = vsource.images[:n_vbatch * args.batch_size].astype(np.float32).reshape(
+        n_vbatch, args.batch_size, c, h, w)
+    vlabels = vsource.labels[:n_vbatch * args.batch_size].reshape(
+        n_vbatch, args.batch_size, 1)
     best_ve = 1.0
     # Training loop.
     for i in range(args.max_iter):
         if i % args.val_interval == 0:
             # Validation
             ve = 0.0
-            for j in range(int(n_valid / args.batch_size)):
-                vimage.d, vlabel.d = vdata.next()
+            for vi, vl in zip(vimages, vlabels):
+                set_input(vimage, vi)
+                set_input(vlabel, vl)
                 vpred.forward(clear_buffer=True)
                 ve += categorical_error(vpred.d, vlabel.d)
-            ve /= int(n_valid / args.batch_size)
+            ve /= n_vbatch
             monitor_verr.add(i, ve)
         if ve < best_ve:
             nn.save_parameters(os.path.join(
                 args.model_save_path, 'params_%06d.h5' % i))
             best_ve = ve
         # Training forward
-        image.d, label.d = data.next()
+        x, t = data.next()
+        set_input(image, x)
+        set_input(label, t)
         solver.zero_grad()
-        loss.forward(clear_no_need_grad=True)
-        loss.backward(clear_buffer=True)
+        loss_error.forward(clear_no_need_grad=True)
+        loss_error.backward(clear_buffer=True)
         solver.weight_decay(args.weight_decay)
         solver.update()
-        e = categorical_error(pred.d, label.d)
-        monitor_loss.add(i, loss.d.copy())
-        monitor_err.add(i, e)
+        if i % log_interval == 0:
+            monitor_loss.add(i, float(loss.d))
+            monitor_err.add(i, float(error.d))
         monitor_time.add(i)
 
     ve = 0.0
-    for j in range(int(n_valid / args.batch_size)):
-        vimage.d, vlabel.d = vdata.next()
+    for vi, vl in zip(vimages, vlabels):
+        set_input(vimage, vi)
+        set_input(vlabel, vl)
         vpred.forward(clear_buffer=True)
         ve += categorical_error(vpred.d, vlabel.d)
-    ve /= int(n_valid / args.batch_size)
+    ve /= n_vbatch
     monitor_verr.add(i, ve)
 
+    data.close()
+
     parameter_file = os.path.join(
         args.model_save_path, 'params_{:06}.h5'.format(args.max_iter))
     nn.save_parameters(parameter_file)